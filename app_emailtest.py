@@ -2,15 +2,14 @@ import streamlit as st
 import email
 import re
 import json
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import csv
+import io
+import hashlib
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from enum import Enum
-import base64
+from functools import lru_cache
 import os
-from io import BytesIO
 
 # Page config
 st.set_page_config(
@@ -21,7 +20,7 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
+CUSTOM_CSS = """
 <style>
     .main-header {
         background: linear-gradient(90deg, #8B4513 0%, #D2691E 100%);
@@ -77,7 +76,8 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # Routing Queue Enum
 class RoutingQueue(Enum):
@@ -87,145 +87,217 @@ class RoutingQueue(Enum):
     RAFT_PRE_ALERT = "RAFT_PreAlert"
     RAFT_ARRIVAL_NOTICE = "RAFT_ArrivalNotice"
 
+# Precompiled patterns (built once at import instead of on every email)
+MONEY_RE = re.compile(r'\$[\d,]+\.?\d*')
+PERCENTAGE_RE = re.compile(r'\d+\.?\d*%')
+# Lookbehind pins the label to the start of a letter/space run; without it every
+# position inside a long run of prose is retried, which is quadratic in body size
+BUDGET_ITEM_RE = re.compile(r'(?<![A-Za-z\s])([A-Za-z\s]+):\s*\$[\d,]+\.?\d*')
+# Local part and domain are capped at their RFC 5321 lengths so a long dotted token with no
+# '@' can't be rescanned from every word boundary
+EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]{1,64}@[A-Za-z0-9.-]{1,253}\.[A-Za-z]{2,}\b')
+PHONE_RE = re.compile(r'\+?1?[-.\s]?\(?[0-9]{3}\)?[-.\s]?[0-9]{3}[-.\s]?[0-9]{4}')
+DATE_RE = re.compile(r'\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]* \d{1,2},? \d{4}\b', re.IGNORECASE)
+# Separator whitespace is consumed by one quantifier; '\s*[#:]?\s*' splits a long blank run
+# every possible way before failing
+ACCOUNT_RE = re.compile(r'(?:Account|ID|Customer)\s*(?:[#:]\s*)?([A-Z0-9-]+)', re.IGNORECASE)
+CONTAINER_RE = re.compile(r'\b[A-Z]{4}\s?\d{6,7}\s?\d\b')
+BOOKING_RE = re.compile(r'(?:Booking|B/L|BL)\s*(?:[#:]\s*)?([A-Z0-9]+)', re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def compile_keywords(keywords: Tuple[str, ...]) -> re.Pattern:
+    """Merge a keyword list into one case-insensitive alternation regex"""
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+
+# Longest body kept per email; everything downstream (routing, analysis, display) reads this copy
+MAX_BODY_CHARS = 1_048_576
+
+# Routing rules, checked in order (first match wins). Built once and shared by every agent;
+# treat as read-only.
+ROUTING_RULES = (
+    {
+        "rule_id": 2,
+        "queue": RoutingQueue.ACCOUNT_INQUIRY_US,
+        "description": "Account Inquiry emails with specific terms",
+        "scenario": "Customer Account Setup/POA Request",
+        "action": "Route to Account Management Team for customer onboarding or Power of Attorney processing",
+        "priority": "HIGH",
+        "sla": "4 hours",
+        "match_label": "account-related",
+        "conditions": {
+            "subject_contains": ["power of attorney", "poa", "account needed", "account setup"],
+            "check_attachments": True
+        }
+    },
+    {
+        "rule_id": 3,
+        "queue": RoutingQueue.ORD_SI_NON_UPS_SHIPMENTS,
+        "description": "Emails from Evergreen Line domain",
+        "scenario": "External Shipping Partner Communication",
+        "action": "Process as non-UPS shipment documentation from Evergreen Marine",
+        "priority": "MEDIUM",
+        "sla": "8 hours",
+        "match_label": "Evergreen Line",
+        "conditions": {
+            "from_domain": "@mail.evergreen-line.com"
+        }
+    },
+    {
+        "rule_id": 4,
+        "queue": RoutingQueue.RAFT_PRE_ALERT,
+        "description": "RAFT Pre-Alert emails",
+        "scenario": "Vessel/Container Pre-Alert Notification",
+        "action": "Prepare for incoming container arrival, notify warehouse teams",
+        "priority": "HIGH",
+        "sla": "2 hours",
+        "match_label": "pre-alert",
+        "conditions": {
+            "subject_contains": ["pre-alert", "pre alert", "prealert"]
+        }
+    },
+    {
+        "rule_id": 5,
+        "queue": RoutingQueue.RAFT_ARRIVAL_NOTICE,
+        "description": "RAFT Arrival Notice emails",
+        "scenario": "Container/Shipment Arrival Confirmation",
+        "action": "Update tracking systems, notify customers, coordinate pickup scheduling",
+        "priority": "HIGH", 
+        "sla": "1 hour",
+        "match_label": "arrival notice",
+        "conditions": {
+            "subject_or_body_contains": ["arrival notice"]
+        }
+    },
+    {
+        "rule_id": 1,
+        "queue": RoutingQueue.SHIPMENT_INITIATION_BRKG_INLAND_SI,
+        "description": "Default rule - all other emails",
+        "scenario": "General Shipment/Logistics Communication",
+        "action": "Process as standard shipment initiation or brokerage inland SI request",
+        "priority": "NORMAL",
+        "sla": "24 hours",
+        "conditions": {
+            "default": True
+        }
+    }
+)
+
+class EmailParseError(Exception):
+    """Raised when uploaded bytes can't be parsed as an email"""
+
 class EmailRoutingAgent:
     """Email Routing Agent for UPS ORD & SF system"""
     
     def __init__(self):
         self.team_mailbox = "noreply-ordchbdocdesk@ups.com"
         self.distribution_list = "ordchbdocdesk@ups.com"
-        self.routing_rules = self._initialize_routing_rules()
+        self.routing_rules = ROUTING_RULES
         self.routing_stats = {
             "total_processed": 0,
             "rules_matched": {rule.value: 0 for rule in RoutingQueue},
         }
     
-    def _initialize_routing_rules(self) -> List[Dict]:
-        return [
-            {
-                "rule_id": 2,
-                "queue": RoutingQueue.ACCOUNT_INQUIRY_US,
-                "description": "Account Inquiry emails with specific terms",
-                "scenario": "Customer Account Setup/POA Request",
-                "action": "Route to Account Management Team for customer onboarding or Power of Attorney processing",
-                "priority": "HIGH",
-                "sla": "4 hours",
-                "conditions": {
-                    "subject_contains": ["power of attorney", "poa", "account needed", "account setup"],
-                    "check_attachments": True
-                }
-            },
-            {
-                "rule_id": 3,
-                "queue": RoutingQueue.ORD_SI_NON_UPS_SHIPMENTS,
-                "description": "Emails from Evergreen Line domain",
-                "scenario": "External Shipping Partner Communication",
-                "action": "Process as non-UPS shipment documentation from Evergreen Marine",
-                "priority": "MEDIUM",
-                "sla": "8 hours",
-                "conditions": {
-                    "from_domain": "@mail.evergreen-line.com"
-                }
-            },
-            {
-                "rule_id": 4,
-                "queue": RoutingQueue.RAFT_PRE_ALERT,
-                "description": "RAFT Pre-Alert emails",
-                "scenario": "Vessel/Container Pre-Alert Notification",
-                "action": "Prepare for incoming container arrival, notify warehouse teams",
-                "priority": "HIGH",
-                "sla": "2 hours",
-                "conditions": {
-                    "subject_contains": ["pre-alert", "pre alert", "prealert"]
-                }
-            },
-            {
-                "rule_id": 5,
-                "queue": RoutingQueue.RAFT_ARRIVAL_NOTICE,
-                "description": "RAFT Arrival Notice emails",
-                "scenario": "Container/Shipment Arrival Confirmation",
-                "action": "Update tracking systems, notify customers, coordinate pickup scheduling",
-                "priority": "HIGH", 
-                "sla": "1 hour",
-                "conditions": {
-                    "subject_or_body_contains": ["arrival notice"]
-                }
-            },
-            {
-                "rule_id": 1,
-                "queue": RoutingQueue.SHIPMENT_INITIATION_BRKG_INLAND_SI,
-                "description": "Default rule - all other emails",
-                "scenario": "General Shipment/Logistics Communication",
-                "action": "Process as standard shipment initiation or brokerage inland SI request",
-                "priority": "NORMAL",
-                "sla": "24 hours",
-                "conditions": {
-                    "default": True
-                }
-            }
-        ]
-    
-    def parse_eml_file(self, eml_content: str) -> Dict:
-        """Parse .eml or .msg file content"""
+    def parse_eml_file(self, eml_content: bytes) -> Dict:
+        """Parse raw .eml or .msg file bytes"""
         try:
-            msg = email.message_from_string(eml_content)
+            msg = email.message_from_bytes(eml_content)
+            for part in msg.walk():
+                self.recover_8bit_headers(part)
             
             email_data = {
-                "message_id": msg.get("Message-ID", ""),
-                "from": msg.get("From", ""),
-                "to": msg.get("To", ""),
-                "cc": msg.get("Cc", ""),
-                "subject": msg.get("Subject", ""),
-                "date": msg.get("Date", ""),
-                "reply_to": msg.get("Reply-To", ""),
-                "priority": msg.get("X-Priority", ""),
+                "message_id": str(msg.get("Message-ID", "")),
+                "from": str(msg.get("From", "")),
+                "to": str(msg.get("To", "")),
+                "cc": str(msg.get("Cc", "")),
+                "subject": str(msg.get("Subject", "")),
+                "date": str(msg.get("Date", "")),
+                "reply_to": str(msg.get("Reply-To", "")),
+                "priority": str(msg.get("X-Priority", "")),
                 "body": "",
                 "attachments": [],
                 "is_html": False
             }
             
-            # Extract body content
+            # Extract body content (collect parts, join once). The plain-text rendering is
+            # preferred; HTML parts are only decoded when the message has no text/plain part.
             if msg.is_multipart():
+                plain_parts = []
+                html_parts = []
                 for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        email_data["body"] += part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    elif part.get_content_type() == "text/html":
-                        email_data["body"] += part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        email_data["is_html"] = True
-                    elif part.get_filename():
-                        email_data["attachments"].append(part.get_filename())
+                    # Containers only hold other parts, which walk() visits on its own
+                    if part.is_multipart():
+                        continue
+                    filename = part.get_filename()
+                    if filename:
+                        # Attached .txt/.html files are attachments, not body text
+                        email_data["attachments"].append(filename)
+                        continue
+                    content_type = part.get_content_type()
+                    if content_type == "text/plain":
+                        plain_parts.append(part)
+                    elif content_type == "text/html":
+                        html_parts.append(part)
+                if plain_parts:
+                    email_data["body"] = self.join_body_parts(plain_parts)
+                elif html_parts:
+                    email_data["body"] = self.join_body_parts(html_parts)
+                    email_data["is_html"] = True
             else:
-                email_data["body"] = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
+                email_data["body"] = self.join_body_parts([msg])
                 if msg.get_content_type() == "text/html":
                     email_data["is_html"] = True
             
             return email_data
             
         except Exception as e:
-            st.error(f"Error parsing email file: {str(e)}")
-            st.info("💡 Note: .msg files work best when converted to .eml format first")
-            return {}
+            raise EmailParseError(str(e)) from e
+    
+    def recover_8bit_headers(self, part):
+        """Re-store raw 8-bit header values as UTF-8 text so get() and get_filename() don't garble them"""
+        # Parsing bytes under compat32 keeps undecodable octets as surrogates, and str() of the
+        # Header that get() then returns replaces them with U+FFFD
+        items = list(part.raw_items())
+        if not any(any("\udc80" <= ch <= "\udcff" for ch in value) for _, value in items):
+            return
+        for name in {name for name, _ in items}:
+            del part[name]
+        for name, value in items:
+            part[name] = value.encode("ascii", "surrogateescape").decode("utf-8", "replace")
+    
+    def join_body_parts(self, parts: List) -> str:
+        """Decode text parts in order, stopping once MAX_BODY_CHARS is reached"""
+        body_parts = []
+        total = 0
+        for part in parts:
+            text = self.decode_part(part)
+            body_parts.append(text)
+            total += len(text)
+            if total >= MAX_BODY_CHARS:
+                break
+        return "".join(body_parts)[:MAX_BODY_CHARS]
+    
+    def decode_part(self, part) -> str:
+        """Decode a message part once, using its declared charset (UTF-8 if missing or unknown)"""
+        payload = part.get_payload(decode=True) or b""
+        try:
+            return payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+        except LookupError:
+            return payload.decode("utf-8", errors="ignore")
     
     def extract_from_domain(self, from_address: str) -> str:
-        """Extract domain from email address"""
-        try:
-            email_match = re.search(r'<([^>]+)>', from_address)
-            if email_match:
-                email_addr = email_match.group(1)
-            else:
-                email_addr = from_address.strip()
-            
-            domain_match = re.search(r'@([^@]+)', email_addr)
-            return f"@{domain_match.group(1)}" if domain_match else ""
-            
-        except Exception:
-            return ""
+        """Extract the lowercased domain from an email address"""
+        # The addr-spec is the last <...> group, and its domain follows the last '@'
+        lt = from_address.rfind("<")
+        gt = from_address.rfind(">")
+        email_addr = from_address[lt + 1:gt] if lt != -1 and gt > lt else from_address.strip()
+        at = email_addr.rfind("@")
+        return email_addr[at:].lower() if at != -1 else ""
     
     def check_text_contains(self, text: str, keywords: List[str]) -> bool:
         """Check if text contains any keywords (case-insensitive)"""
         if not text:
             return False
-        text_lower = text.lower()
-        return any(keyword.lower() in text_lower for keyword in keywords)
+        return compile_keywords(tuple(keywords)).search(text) is not None
     
     def check_attachment_naming(self, attachments: List[str], keywords: List[str]) -> bool:
         """Check if attachment names contain keywords"""
@@ -240,45 +312,34 @@ class EmailRoutingAgent:
         """Apply specific routing rule and return (matched, reason)"""
         conditions = rule["conditions"]
         
-        # Rule 2: Account Inquiry
-        if "subject_contains" in conditions and rule["rule_id"] == 2:
-            subject_match = self.check_text_contains(email_data["subject"], conditions["subject_contains"])
-            attachment_match = False
-            
-            if conditions.get("check_attachments", False):
-                attachment_match = self.check_attachment_naming(
-                    email_data["attachments"], conditions["subject_contains"]
-                )
-            
-            if subject_match:
-                return True, f"Subject contains account-related keywords: {conditions['subject_contains']}"
-            elif attachment_match:
-                return True, f"Attachment names contain account-related keywords"
+        label = rule.get("match_label", "")
+        
+        # Subject keyword rules (Account Inquiry, RAFT Pre-Alert), optionally also checking attachment names
+        if "subject_contains" in conditions:
+            keywords = conditions["subject_contains"]
+            if self.check_text_contains(email_data["subject"], keywords):
+                return True, f"Subject contains {label} keywords: {keywords}"
+            if conditions.get("check_attachments", False) and self.check_attachment_naming(
+                email_data["attachments"], keywords
+            ):
+                return True, f"Attachment names contain {label} keywords"
             return False, ""
         
-        # Rule 3: Domain-based routing  
+        # Domain-based routing
         if "from_domain" in conditions:
             from_domain = self.extract_from_domain(email_data["from"])
             if from_domain == conditions["from_domain"]:
-                return True, f"Email from Evergreen Line domain: {from_domain}"
+                return True, f"Email from {label} domain: {from_domain}"
             return False, f"Domain {from_domain} does not match {conditions['from_domain']}"
         
-        # Rule 4: RAFT Pre-Alert
-        if "subject_contains" in conditions and rule["rule_id"] == 4:
-            if self.check_text_contains(email_data["subject"], conditions["subject_contains"]):
-                return True, f"Subject contains pre-alert keywords: {conditions['subject_contains']}"
-            return False, ""
-        
-        # Rule 5: RAFT Arrival Notice
+        # Subject-or-body keyword rules (RAFT Arrival Notice)
         if "subject_or_body_contains" in conditions:
             keywords = conditions["subject_or_body_contains"]
-            subject_match = self.check_text_contains(email_data["subject"], keywords)
-            body_match = self.check_text_contains(email_data["body"], keywords)
-            
-            if subject_match:
-                return True, f"Subject contains arrival notice keywords: {keywords}"
-            elif body_match:
-                return True, f"Body contains arrival notice keywords: {keywords}"
+            # Subject first: the body is only scanned when the subject doesn't already match
+            if self.check_text_contains(email_data["subject"], keywords):
+                return True, f"Subject contains {label} keywords: {keywords}"
+            if self.check_text_contains(email_data["body"], keywords):
+                return True, f"Body contains {label} keywords: {keywords}"
             return False, ""
         
         # Rule 1: Default rule
@@ -287,42 +348,35 @@ class EmailRoutingAgent:
         
         return False, ""
     
-    def route_email(self, eml_content: str) -> Dict:
-        """Main routing function"""
-        try:
-            email_data = self.parse_eml_file(eml_content)
-            if not email_data:
-                raise Exception("Failed to parse email")
-            
-            for rule in self.routing_rules:
-                matched, reason = self.apply_routing_rule(email_data, rule)
-                if matched:
-                    routing_result = {
-                        "routing_queue": rule["queue"].value,
-                        "rule_matched": rule["rule_id"],
-                        "rule_description": rule["description"],
-                        "scenario": rule["scenario"],
-                        "action": rule["action"],
-                        "priority": rule["priority"],
-                        "sla": rule["sla"],
-                        "match_reason": reason,
-                        "email_data": email_data,
-                        "routing_timestamp": datetime.now().isoformat(),
-                        "confidence": "HIGH" if rule["rule_id"] != 1 else "DEFAULT"
-                    }
-                    
-                    self.routing_stats["total_processed"] += 1
-                    self.routing_stats["rules_matched"][rule["queue"].value] += 1
-                    
-                    return routing_result
-            
-            raise Exception("No routing rule matched")
-            
-        except Exception as e:
-            st.error(f"Routing error: {str(e)}")
-            return {}
+    def route_email(self, eml_content: bytes) -> Dict:
+        """Main routing function; raises EmailParseError if the upload can't be parsed"""
+        email_data = self.parse_eml_file(eml_content)
+        
+        for rule in self.routing_rules:
+            matched, reason = self.apply_routing_rule(email_data, rule)
+            if matched:
+                routing_result = {
+                    "routing_queue": rule["queue"].value,
+                    "rule_matched": rule["rule_id"],
+                    "rule_description": rule["description"],
+                    "scenario": rule["scenario"],
+                    "action": rule["action"],
+                    "priority": rule["priority"],
+                    "sla": rule["sla"],
+                    "match_reason": reason,
+                    "email_data": email_data,
+                    "routing_timestamp": datetime.now().isoformat(),
+                    "confidence": "HIGH" if rule["rule_id"] != 1 else "DEFAULT"
+                }
+                
+                self.routing_stats["total_processed"] += 1
+                self.routing_stats["rules_matched"][rule["queue"].value] += 1
+                
+                return routing_result
+        
+        raise Exception("No routing rule matched")
 
-def extract_financial_data(email_body: str) -> Dict:
+def extract_financial_data(email_body: str, amounts: Optional[List[str]] = None) -> Dict:
     """Extract financial information from email"""
     financial_data = {
         "amounts": [],
@@ -332,20 +386,19 @@ def extract_financial_data(email_body: str) -> Dict:
         "budget_items": []
     }
     
-    # Money pattern ($123, $1,234.56)
-    money_pattern = r'\$[\d,]+\.?\d*'
-    amounts = re.findall(money_pattern, email_body)
-    financial_data["amounts"] = amounts
+    # Each pattern needs a literal '$' or '%', so a cheap membership test skips the scan when absent
+    has_dollar = "$" in email_body
+    
+    # Money pattern ($123, $1,234.56) - reuse amounts already found by extract_entities if given
+    financial_data["amounts"] = amounts if amounts is not None else (MONEY_RE.findall(email_body) if has_dollar else [])
     
     # Percentage pattern (25%, 3.5%)
-    percentage_pattern = r'\d+\.?\d*%'
-    percentages = re.findall(percentage_pattern, email_body)
-    financial_data["percentages"] = percentages
+    if "%" in email_body:
+        financial_data["percentages"] = PERCENTAGE_RE.findall(email_body)
     
     # Budget line items
-    budget_pattern = r'([A-Za-z\s]+):\s*\$[\d,]+\.?\d*'
-    budget_items = re.findall(budget_pattern, email_body)
-    financial_data["budget_items"] = budget_items
+    if has_dollar:
+        financial_data["budget_items"] = BUDGET_ITEM_RE.findall(email_body)
     
     return financial_data
 
@@ -362,47 +415,64 @@ def extract_entities(email_content: str) -> Dict:
         "booking_refs": []
     }
     
-    # Email pattern
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    entities["emails"] = re.findall(email_pattern, email_content)
+    # Email pattern (skipped outright when there is no '@')
+    if "@" in email_content:
+        entities["emails"] = EMAIL_RE.findall(email_content)
     
     # Phone pattern
-    phone_pattern = r'\+?1?[-.\s]?\(?[0-9]{3}\)?[-.\s]?[0-9]{3}[-.\s]?[0-9]{4}'
-    entities["phones"] = re.findall(phone_pattern, email_content)
+    entities["phones"] = PHONE_RE.findall(email_content)
     
     # Date pattern
-    date_pattern = r'\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]* \d{1,2},? \d{4}\b'
-    entities["dates"] = re.findall(date_pattern, email_content, re.IGNORECASE)
+    entities["dates"] = DATE_RE.findall(email_content)
     
-    # Amount pattern
-    amount_pattern = r'\$[\d,]+\.?\d*'
-    entities["amounts"] = re.findall(amount_pattern, email_content)
+    # Amount pattern (skipped outright when there is no '$')
+    if "$" in email_content:
+        entities["amounts"] = MONEY_RE.findall(email_content)
     
     # Account number pattern
-    account_pattern = r'(?:Account|ID|Customer)\s*[#:]?\s*([A-Z0-9-]+)'
-    entities["account_numbers"] = re.findall(account_pattern, email_content, re.IGNORECASE)
+    entities["account_numbers"] = ACCOUNT_RE.findall(email_content)
     
     # Container number pattern
-    container_pattern = r'\b[A-Z]{4}\s?\d{6,7}\s?\d\b'
-    entities["container_numbers"] = re.findall(container_pattern, email_content)
+    entities["container_numbers"] = CONTAINER_RE.findall(email_content)
     
     # Booking reference pattern
-    booking_pattern = r'(?:Booking|B/L|BL)\s*[#:]?\s*([A-Z0-9]+)'
-    entities["booking_refs"] = re.findall(booking_pattern, email_content, re.IGNORECASE)
+    entities["booking_refs"] = BOOKING_RE.findall(email_content)
     
     return entities
 
+POSITIVE_WORDS = ('thanks', 'appreciate', 'excellent', 'great', 'pleased', 'happy', 'satisfied', 'good', 'wonderful')
+NEGATIVE_WORDS = ('urgent', 'frustrated', 'angry', 'disappointed', 'unacceptable', 'complaint', 'issue', 'problem', 'error', 'wrong', 'terrible', 'awful')
+URGENCY_WORDS = ('urgent', 'asap', 'immediately', 'critical', 'emergency', 'deadline', 'overdue')
+
+# Keyword -> sentiment buckets it counts toward ("urgent" is both negative and urgency)
+SENTIMENT_BUCKETS = {"positive": POSITIVE_WORDS, "negative": NEGATIVE_WORDS, "urgency": URGENCY_WORDS}
+SENTIMENT_TAGS = {
+    word: tuple(bucket for bucket, words in SENTIMENT_BUCKETS.items() if word in words)
+    for words in SENTIMENT_BUCKETS.values() for word in words
+}
+# Nouns that also count in their plural form ("issues", "deadlines")
+PLURAL_SENTIMENT_WORDS = ('complaint', 'issue', 'problem', 'error', 'deadline')
+# Whole words only, so "goods" doesn't count as "good" or "thanksgiving" as "thanks"
+SENTIMENT_RE = re.compile(
+    r"\b(?:" + "|".join(
+        re.escape(word) + ("s?" if word in PLURAL_SENTIMENT_WORDS else "") for word in SENTIMENT_TAGS
+    ) + r")\b",
+    re.IGNORECASE
+)
+
 def analyze_sentiment(email_content: str) -> Dict:
     """Enhanced sentiment analysis"""
-    positive_words = ['thanks', 'appreciate', 'excellent', 'great', 'pleased', 'happy', 'satisfied', 'good', 'wonderful']
-    negative_words = ['urgent', 'frustrated', 'angry', 'disappointed', 'unacceptable', 'complaint', 'issue', 'problem', 'error', 'wrong', 'terrible', 'awful']
-    urgency_words = ['urgent', 'asap', 'immediately', 'critical', 'emergency', 'deadline', 'overdue']
-    
-    content_lower = email_content.lower()
-    
-    positive_count = sum(1 for word in positive_words if word in content_lower)
-    negative_count = sum(1 for word in negative_words if word in content_lower)
-    urgency_count = sum(1 for word in urgency_words if word in content_lower)
+    # One case-insensitive scan for all word bags, then tally distinct hits per bucket
+    found = {match.group().lower() for match in SENTIMENT_RE.finditer(email_content)}
+    # Plurals count as their singular, so "issue" and "issues" are one distinct hit
+    found = {word if word in SENTIMENT_TAGS else word[:-1] for word in found}
+    counts = dict.fromkeys(SENTIMENT_BUCKETS, 0)
+    for word in found:
+        for bucket in SENTIMENT_TAGS[word]:
+            counts[bucket] += 1
+    positive_count = counts["positive"]
+    negative_count = counts["negative"]
+    urgency_count = counts["urgency"]
     
     # Determine sentiment
     if negative_count > positive_count:
@@ -432,13 +502,20 @@ def analyze_sentiment(email_content: str) -> Dict:
         "urgency_indicators": urgency_count
     }
 
-def claude_analysis(email_content: str, api_key: str) -> str:
-    """Analyze email with Claude AI"""
-    try:
-        import anthropic
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        prompt = f"""Analyze this email comprehensively and provide actionable insights:
+@st.cache_data(max_entries=128, show_spinner=False)
+def analyze_content(email_content: str) -> Tuple[Dict, Dict, Dict]:
+    """Run entity, financial and sentiment analysis in one cached pass (amounts are scanned once)"""
+    entities = extract_entities(email_content)
+    financial_data = extract_financial_data(email_content, amounts=entities["amounts"])
+    return entities, financial_data, analyze_sentiment(email_content)
+
+# Longest body excerpt sent to Claude; the rest of the email adds tokens, not insight
+CLAUDE_BODY_CHAR_LIMIT = 8000
+# Caps for user-controlled text rendered on the page
+DISPLAY_FIELD_CHAR_LIMIT = 300
+BODY_DISPLAY_CHAR_LIMIT = 2000
+
+CLAUDE_PROMPT_TEMPLATE = """Analyze this email comprehensively and provide actionable insights:
 
 1. **BUSINESS SCENARIO CLASSIFICATION:**
    - What type of business scenario is this?
@@ -475,16 +552,44 @@ Email content:
 {email_content}
 
 Provide a structured, actionable analysis that a business user can immediately act upon."""
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            temperature=0,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        return message.content[0].text
-        
+
+def truncate_text(text: str, limit: int) -> str:
+    """Cut text to at most limit characters, backing off to the last whitespace"""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    if not (cut[-1:].isspace() or text[limit].isspace()):
+        words = cut.rsplit(None, 1)
+        cut = words[0] if len(words) > 1 else cut
+    return cut.rstrip() + "..."
+
+@st.cache_resource(max_entries=8, ttl=3600, show_spinner=False)
+def get_anthropic_client(api_key: str):
+    """One Anthropic client per API key, so its connection pool is reused across analyses.
+    Bounded and expiring so keys typed into the sidebar aren't held for the life of the process."""
+    import anthropic
+    return anthropic.Anthropic(api_key=api_key)
+
+@st.cache_data(max_entries=128, ttl=3600, show_spinner=False)
+def request_claude_analysis(email_content: str, api_key: str) -> str:
+    """Call Claude for one email; cached so Streamlit reruns don't repeat the API call"""
+    client = get_anthropic_client(api_key)
+    
+    prompt = CLAUDE_PROMPT_TEMPLATE.format(email_content=email_content)
+    
+    message = client.messages.create(
+        model="claude-sonnet-4-20250514",
+        max_tokens=2000,
+        temperature=0,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    
+    return message.content[0].text
+
+def claude_analysis(email_content: str, api_key: str) -> str:
+    """Analyze email with Claude AI"""
+    try:
+        return request_claude_analysis(email_content, api_key)
     except Exception as e:
         return f"❌ **Error in analysis:** {str(e)}\n\n**Possible solutions:**\n- Check your API key format (should start with 'sk-ant-')\n- Verify your API key is active\n- Ensure you have API credits available"
 
@@ -505,17 +610,89 @@ def get_api_key():
     
     return api_key
 
+HEADER_HTML = """
+<div class="main-header">
+    <h1>📧 Brokerage Email Automation Manager</h1>
+    <h2 style="text-align: center; color: white; margin: 0; font-size: 1.5em;">BEAM</h2>
+    <p style="text-align: center; color: white; margin: 0;">
+        Intelligent Email Processing & AI-Powered Analysis
+    </p>
+</div>
+"""
+
+# Routing cards, filled per email with format_map(routing_result)
+ROUTING_RESULT_HTML = """
+<div class="routing-result">
+    <h3>🎯 ROUTING DECISION</h3>
+    <p><strong>📋 SCENARIO:</strong> {scenario}</p>
+    <p><strong>🏷️ QUEUE:</strong> {routing_queue}</p>
+    <p><strong>⚡ PRIORITY:</strong> {priority}</p>
+    <p><strong>⏰ SLA:</strong> {sla}</p>
+    <p><strong>✅ RULE:</strong> Rule {rule_matched} - {rule_description}</p>
+    <p><strong>🔍 MATCH REASON:</strong> {match_reason}</p>
+</div>
+"""
+
+ACTION_BOX_HTML = """
+<div class="action-box">
+    <h3>🎯 RECOMMENDED ACTION</h3>
+    <p><strong>{action}</strong></p>
+    <p><strong>📅 Response Required By:</strong> {sla} from now</p>
+    <p><strong>🔔 Next Steps:</strong> Assign to {routing_queue} team for processing</p>
+</div>
+"""
+
+# Rule summary box, filled per rule with format_map(rule)
+RULE_BOX_HTML = """<div class="rule-box">
+    <strong>Rule {rule_id}:</strong> {scenario}<br>
+    <strong>Priority:</strong> {priority} | <strong>SLA:</strong> {sla}
+</div>"""
+
+def display_field(email_data: Dict, key: str, default: str = 'N/A') -> str:
+    """Header value for markdown display, capped so oversized headers can't bloat the page"""
+    return truncate_text(email_data.get(key, default), DISPLAY_FIELD_CHAR_LIMIT)
+
+def render_entity_list(label: str, items: List[str], limit: int = 5):
+    """Render a labelled bullet list as a single markdown element"""
+    if items:
+        # Cap each item like header fields (some entity patterns have unbounded runs), then
+        # escape '$' so two amounts on separate lines aren't read as a LaTeX $...$ span
+        bullets = "  \n".join(
+            "• " + truncate_text(item, DISPLAY_FIELD_CHAR_LIMIT).replace("$", r"\$")
+            for item in items[:limit]
+        )
+        st.markdown(f"**{label}:**  \n{bullets}")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_export_json(export_data: Dict) -> str:
+    """Serialize the export payload; cached so reruns of the Export tab reuse the string"""
+    return json.dumps(export_data, indent=2)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_entity_csv(entities: Dict) -> str:
+    """Flatten extracted entities into a Type,Value CSV; cached per entity set"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(("Type", "Value"))
+    writer.writerows(
+        (entity_type, entity) for entity_type, entity_list in entities.items() for entity in entity_list
+    )
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_queue_pie(queue_counts: Tuple[Tuple[str, int], ...]):
+    """Queue distribution pie chart, cached per counts snapshot so reruns reuse the figure"""
+    import plotly.express as px
+    return px.pie(
+        values=[count for _, count in queue_counts],
+        names=[queue for queue, _ in queue_counts],
+        title="Email Routing Distribution",
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+
 def main():
     # Header
-    st.markdown("""
-    <div class="main-header">
-        <h1>📧 Brokerage Email Automation Manager</h1>
-        <h2 style="text-align: center; color: white; margin: 0; font-size: 1.5em;">BEAM</h2>
-        <p style="text-align: center; color: white; margin: 0;">
-            Intelligent Email Processing & AI-Powered Analysis
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
     
     # Sidebar
     st.sidebar.header("🔧 Configuration")
@@ -575,48 +752,46 @@ def main():
         if uploaded_file is not None:
             # Read file content
             try:
+                # Raw bytes go straight to the parser, which decodes each part with its own charset
+                eml_content = uploaded_file.getvalue()
                 if uploaded_file.name.endswith('.msg'):
-                    # For .msg files, try to read as text (may require conversion)
-                    eml_content = uploaded_file.read().decode('utf-8', errors='ignore')
+                    # .msg files are processed as email format (may require conversion)
                     st.info("📧 .msg file detected - processing as email format")
-                else:
-                    # For .eml files, standard processing
-                    eml_content = uploaded_file.read().decode('utf-8')
                     
             except Exception as e:
                 st.error(f"Error reading file: {str(e)}")
                 st.info("💡 Tip: If using .msg files, try saving as .eml format in Outlook first")
                 return
             
-            # Process email
-            with st.spinner("🔄 Processing email..."):
-                routing_result = agent.route_email(eml_content)
+            # Process email once per distinct upload; reruns reuse the stored result
+            content_hash = hashlib.sha256(eml_content).hexdigest()
+            if st.session_state.get('routing_content_hash') == content_hash:
+                routing_result = st.session_state.routing_result
+            else:
+                try:
+                    with st.spinner("🔄 Processing email..."):
+                        routing_result = agent.route_email(eml_content)
+                except EmailParseError as e:
+                    st.error(f"Error parsing email file: {str(e)}")
+                    st.info("💡 Note: .msg files work best when converted to .eml format first")
+                    routing_result = None
+                except Exception as e:
+                    st.error(f"Routing error: {str(e)}")
+                    routing_result = None
+                else:
+                    # Only a successful result is stored; errors fall through so the
+                    # dashboard column still renders
+                    st.session_state.routing_result = routing_result
+                    st.session_state.routing_content_hash = content_hash
             
             if routing_result:
                 email_data = routing_result['email_data']
                 
                 # Display routing result with clear scenario
-                st.markdown(f"""
-                <div class="routing-result">
-                    <h3>🎯 ROUTING DECISION</h3>
-                    <p><strong>📋 SCENARIO:</strong> {routing_result['scenario']}</p>
-                    <p><strong>🏷️ QUEUE:</strong> {routing_result['routing_queue']}</p>
-                    <p><strong>⚡ PRIORITY:</strong> {routing_result['priority']}</p>
-                    <p><strong>⏰ SLA:</strong> {routing_result['sla']}</p>
-                    <p><strong>✅ RULE:</strong> Rule {routing_result['rule_matched']} - {routing_result['rule_description']}</p>
-                    <p><strong>🔍 MATCH REASON:</strong> {routing_result['match_reason']}</p>
-                </div>
-                """, unsafe_allow_html=True)
+                st.markdown(ROUTING_RESULT_HTML.format_map(routing_result), unsafe_allow_html=True)
                 
                 # Action recommendations
-                st.markdown(f"""
-                <div class="action-box">
-                    <h3>🎯 RECOMMENDED ACTION</h3>
-                    <p><strong>{routing_result['action']}</strong></p>
-                    <p><strong>📅 Response Required By:</strong> {routing_result['sla']} from now</p>
-                    <p><strong>🔔 Next Steps:</strong> Assign to {routing_result['routing_queue']} team for processing</p>
-                </div>
-                """, unsafe_allow_html=True)
+                st.markdown(ACTION_BOX_HTML.format_map(routing_result), unsafe_allow_html=True)
                 
                 # Email details tabs
                 tab1, tab2, tab3, tab4 = st.tabs(["📧 Email Details", "📊 Smart Analysis", "  AI Analysis", "📥 Export"])
@@ -626,24 +801,25 @@ def main():
                     
                     col_a, col_b = st.columns(2)
                     with col_a:
-                        st.markdown(f"**From:** {email_data.get('from', 'N/A')}")
-                        st.markdown(f"**To:** {email_data.get('to', 'N/A')}")
-                        st.markdown(f"**Subject:** {email_data.get('subject', 'N/A')}")
-                        st.markdown(f"**Date:** {email_data.get('date', 'N/A')}")
+                        st.markdown(f"**From:** {display_field(email_data, 'from')}")
+                        st.markdown(f"**To:** {display_field(email_data, 'to')}")
+                        st.markdown(f"**Subject:** {display_field(email_data, 'subject')}")
+                        st.markdown(f"**Date:** {display_field(email_data, 'date')}")
                     
                     with col_b:
-                        st.markdown(f"**Message ID:** {email_data.get('message_id', 'N/A')}")
-                        st.markdown(f"**CC:** {email_data.get('cc', 'N/A')}")
-                        st.markdown(f"**Priority:** {email_data.get('priority', 'Normal')}")
+                        st.markdown(f"**Message ID:** {display_field(email_data, 'message_id')}")
+                        st.markdown(f"**CC:** {display_field(email_data, 'cc')}")
+                        st.markdown(f"**Priority:** {display_field(email_data, 'priority', 'Normal')}")
                         if email_data.get('attachments'):
-                            st.markdown(f"**Attachments:** {', '.join(email_data['attachments'])}")
+                            attachments = truncate_text(', '.join(email_data['attachments']), DISPLAY_FIELD_CHAR_LIMIT)
+                            st.markdown(f"**Attachments:** {attachments}")
                     
                     st.subheader("Email Body")
                     if email_data.get('is_html'):
                         st.markdown("*HTML content detected - showing cleaned text*")
                     
                     # Show email body in scrollable box
-                    body_text = email_data.get('body', '')[:2000]  # Limit display
+                    body_text = email_data.get('body', '')[:BODY_DISPLAY_CHAR_LIMIT]
                     st.text_area("Email Content", body_text, height=300, disabled=True)
                 
                 with tab2:
@@ -651,8 +827,7 @@ def main():
                     
                     # Entity extraction
                     full_content = email_data.get('body', '') + ' ' + email_data.get('subject', '')
-                    entities = extract_entities(full_content)
-                    financial_data = extract_financial_data(full_content)
+                    entities, financial_data, sentiment_data = analyze_content(full_content)
                     
                     # Key metrics
                     col_met1, col_met2, col_met3 = st.columns(3)
@@ -663,40 +838,16 @@ def main():
                     # Entity details
                     col_x, col_y = st.columns(2)
                     with col_x:
-                        if entities['emails']:
-                            st.markdown("**📧 Email Addresses:**")
-                            for email_addr in entities['emails'][:5]:  # Limit display
-                                st.write(f"• {email_addr}")
-                        
-                        if entities['phones']:
-                            st.markdown("**📞 Phone Numbers:**")
-                            for phone in entities['phones'][:5]:
-                                st.write(f"• {phone}")
-                        
-                        if entities['account_numbers']:
-                            st.markdown("**🔢 Account Numbers:**")
-                            for acc in entities['account_numbers'][:5]:
-                                st.write(f"• {acc}")
+                        render_entity_list("📧 Email Addresses", entities['emails'])
+                        render_entity_list("📞 Phone Numbers", entities['phones'])
+                        render_entity_list("🔢 Account Numbers", entities['account_numbers'])
                     
                     with col_y:
-                        if entities['dates']:
-                            st.markdown("**📅 Important Dates:**")
-                            for date in entities['dates'][:5]:
-                                st.write(f"• {date}")
-                        
-                        if entities['amounts']:
-                            st.markdown("**💰 Financial Amounts:**")
-                            for amount in entities['amounts'][:5]:
-                                st.write(f"• {amount}")
-                        
-                        if entities['container_numbers']:
-                            st.markdown("**📦 Container Numbers:**")
-                            for container in entities['container_numbers'][:5]:
-                                st.write(f"• {container}")
+                        render_entity_list("📅 Important Dates", entities['dates'])
+                        render_entity_list("💰 Financial Amounts", entities['amounts'])
+                        render_entity_list("📦 Container Numbers", entities['container_numbers'])
                     
                     # Sentiment analysis
-                    sentiment_data = analyze_sentiment(full_content)
-                    
                     st.markdown("**😊 Sentiment & Urgency Analysis:**")
                     col_sent1, col_sent2, col_sent3, col_sent4 = st.columns(4)
                     col_sent1.metric("Sentiment", sentiment_data['sentiment'])
@@ -721,7 +872,7 @@ def main():
                             Routing Decision: {routing_result['scenario']} → {routing_result['routing_queue']}
                             
                             Body:
-                            {email_data.get('body', 'N/A')}
+                            {truncate_text(email_data.get('body', 'N/A'), CLAUDE_BODY_CHAR_LIMIT)}
                             """
                             
                             analysis = claude_analysis(email_content, api_key)
@@ -730,6 +881,10 @@ def main():
                 with tab4:
                     st.subheader("📥 Export Results")
                     
+                    # Stamp exports with the routing time so they stay stable across reruns
+                    processed_at = routing_result['routing_timestamp']
+                    file_stamp = datetime.fromisoformat(processed_at).strftime('%Y%m%d_%H%M%S')
+                    
                     # Prepare comprehensive export data
                     export_data = {
                         "routing_decision": {
@@ -751,34 +906,27 @@ def main():
                         "entities": entities,
                         "sentiment": sentiment_data,
                         "financial_data": financial_data,
-                        "processing_timestamp": datetime.now().isoformat()
+                        "processing_timestamp": processed_at
                     }
                     
-                    export_json = json.dumps(export_data, indent=2)
+                    export_json = build_export_json(export_data)
                     
                     st.download_button(
                         label="📋 Download Complete Analysis (JSON)",
                         data=export_json,
-                        file_name=f"email_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                        file_name=f"email_analysis_{file_stamp}.json",
                         mime="application/json"
                     )
                     
                     # CSV export for entities
                     if any(entities.values()):
-                        rows = []
-                        for entity_type, entity_list in entities.items():
-                            for entity in entity_list:
-                                rows.append({"Type": entity_type, "Value": entity})
-                        
-                        if rows:
-                            entity_df = pd.DataFrame(rows)
-                            csv = entity_df.to_csv(index=False)
-                            st.download_button(
-                                label="📊 Download Entities (CSV)",
-                                data=csv,
-                                file_name=f"email_entities_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                mime="text/csv"
-                            )
+                        entity_csv = build_entity_csv(entities)
+                        st.download_button(
+                            label="📊 Download Entities (CSV)",
+                            data=entity_csv,
+                            file_name=f"email_entities_{file_stamp}.csv",
+                            mime="text/csv"
+                        )
     
     with col2:
         st.header("📊 System Dashboard")
@@ -795,12 +943,7 @@ def main():
             queue_data = {k: v for k, v in stats['rules_matched'].items() if v > 0}
             
             if queue_data:
-                fig = px.pie(
-                    values=list(queue_data.values()),
-                    names=list(queue_data.keys()),
-                    title="Email Routing Distribution",
-                    color_discrete_sequence=px.colors.qualitative.Set3
-                )
+                fig = build_queue_pie(tuple(queue_data.items()))
                 st.plotly_chart(fig, use_container_width=True)
         
         st.markdown("---")
@@ -812,13 +955,8 @@ def main():
         # Rule summary
         st.markdown("---")
         st.subheader("📋 Rule Summary")
-        for rule in agent.routing_rules:
-            st.markdown(f"""
-            <div class="rule-box">
-                <strong>Rule {rule['rule_id']}:</strong> {rule['scenario']}<br>
-                <strong>Priority:</strong> {rule['priority']} | <strong>SLA:</strong> {rule['sla']}
-            </div>
-            """, unsafe_allow_html=True)
+        rule_boxes = "\n".join(RULE_BOX_HTML.format_map(rule) for rule in agent.routing_rules)
+        st.markdown(rule_boxes, unsafe_allow_html=True)
 
 if __name__ == "__main__":
     main()
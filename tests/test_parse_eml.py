@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_emailtest import EmailRoutingAgent
+
+
+RAW_8BIT_EMAIL = (
+    "From: Zoë Müller <zoe@example.com>\r\n"
+    "To: ops@example.com\r\n"
+    "Subject: Café pre-alert\r\n"
+    "MIME-Version: 1.0\r\n"
+    "Content-Type: multipart/mixed; boundary=BOUNDARY\r\n"
+    "\r\n"
+    "--BOUNDARY\r\n"
+    "Content-Type: text/plain; charset=utf-8\r\n"
+    "\r\n"
+    "Please find the POA attached.\r\n"
+    "--BOUNDARY\r\n"
+    "Content-Type: application/pdf\r\n"
+    "Content-Disposition: attachment; filename=\"Vollmacht_Zoë POA.pdf\"\r\n"
+    "\r\n"
+    "data\r\n"
+    "--BOUNDARY--\r\n"
+).encode("utf-8")
+
+
+class ParseEmlNonAsciiHeadersTest(unittest.TestCase):
+    """Raw 8-bit UTF-8 headers must come through parse_eml_file intact"""
+
+    def setUp(self):
+        self.email_data = EmailRoutingAgent().parse_eml_file(RAW_8BIT_EMAIL)
+
+    def test_from_is_decoded(self):
+        self.assertEqual(self.email_data["from"], "Zoë Müller <zoe@example.com>")
+
+    def test_subject_is_decoded(self):
+        self.assertEqual(self.email_data["subject"], "Café pre-alert")
+
+    def test_attachment_name_is_decoded(self):
+        self.assertEqual(self.email_data["attachments"], ["Vollmacht_Zoë POA.pdf"])
+
+    def test_body_is_unaffected(self):
+        self.assertEqual(self.email_data["body"].strip(), "Please find the POA attached.")
+
+
+if __name__ == "__main__":
+    unittest.main()